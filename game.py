@@ -1,171 +1,192 @@
 from flask import Flask, jsonify, request, session, render_template
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_session import Session
 from dotenv import load_dotenv
+import orjson
+import redis
 import os
+import re
+import secrets
 import sqlite3
-import json
-from langchain.llms import OpenAI
-from langchain.prompts import PromptTemplate
+import threading
+from dataclasses import dataclass, field
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from langchain_openai import ChatOpenAI
 
-app = Flask(__name__)
-CORS(app)
-app.secret_key = os.urandom(24)
+load_dotenv()
 
 
-class ModernWesterosGame:
-    def __init__(self):
-        load_dotenv()
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OpenAI API key not found in environment variables")
-
-        self.llm = OpenAI(temperature=0.8)
-        self.player_history = []
-        self.happiness = 30  # Starting happiness
-        self.wealth = 100000  # Starting wealth
-        self.turn_count = 0
-        self.game_id = os.urandom(16).hex()
+class OrjsonProvider(JSONProvider):
+    """Serve jsonify and request.get_json through orjson."""
 
-        self.setup_templates()
-        self.setup_database()
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
 
-    def get_serializable_state(self):
-        """Return a JSON-serializable state of the game."""
-        return {
-            "player_history": self.player_history,
-            "happiness": self.happiness,
-            "wealth": self.wealth,
-            "turn_count": self.turn_count,
-            "game_id": self.game_id,
-        }
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-    def load_state(self, state):
-        """Load game state from a dictionary."""
-        self.player_history = state["player_history"]
-        self.happiness = state["happiness"]
-        self.wealth = state["wealth"]
-        self.turn_count = state["turn_count"]
-        self.game_id = state["game_id"]
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding
+        # them to str for Werkzeug to encode again.
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
 
-    def setup_database(self):
-        conn = sqlite3.connect("westeros_realty.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS choices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                choice_text TEXT NOT NULL,
-                game_id TEXT NOT NULL
-            )
-        """
-        )
-        conn.commit()
-        conn.close()
-
-    def setup_templates(self):
-        self.story_template = PromptTemplate(
-            input_variables=[
-                "history",
-                "current_situation",
-                "happiness",
-                "wealth",
-                "previous_choices",
-            ],
-            template=(
-                "You are a witty narrator in a world where Jon Snow has traded his Night's Watch cloak for a realtor's suit. "
-                "Mix modern real estate scenarios with Game of Thrones references and humor.\n\n"
-                "Jon's Current Status:\n"
-                "Happiness: {happiness}/100\n"
-                "Wealth: ${wealth}\n\n"
-                "Previous choices in this game: {history}\n"
-                "Previously used choices in database: {previous_choices}\n"
-                "Current situation: {current_situation}\n\n"
-                "Generate a short story segment (2-3 sentences) with Game of Thrones references.\n"
-                "Then provide 3 UNIQUE choices that are witty and concise (max 15 words each).\n"
-                "Use GOT-style humor and puns in the choices. Each choice must have exact numerical impacts in parentheses.\n\n"
-                "Format your response as follows:\n"
-                "STORY: [Your story text here]\n"
-                "CHOICES:\n"
-                "1. Act like a Dothraki: Take what is yours with fire and blood (Happiness: +20, Wealth: -50000)\n"
-                "2. Consult with Bran: See the future and make wise investments (Happiness: +10, Wealth: +25000)\n"
-                "3. Meet with the Iron Bank: Get a loan and rule the market (Happiness: -15, Wealth: +40000)\n\n"
-                "IMPORTANT FORMAT RULES:\n"
-                "- Do not use square brackets []\n"
-                "- Never use +/- together\n"
-                "- Always specify a sign (+ or -) for every number\n"
-                "- No spaces in numbers\n"
-                "- Keep exact order: Happiness, Wealth\n"
-            ),
-        )
 
-        self.consequence_template = PromptTemplate(
-            input_variables=["history", "choice", "happiness", "wealth"],
-            template=(
-                "Based on Jon's history: {history}\n"
-                "Current status:\n"
-                "Happiness: {happiness}/100\n"
-                "Wealth: ${wealth}\n"
-                "They chose: {choice}\n\n"
-                "Generate a consequence (2-3 sentences) that blends modern real estate outcomes with Game of Thrones references.\n"
-                "Be creative and humorous while keeping the real estate aspects realistic."
-            ),
-        )
+app = Flask(__name__)
+app.json = OrjsonProvider(app)
+CORS(app)
+# A fixed SECRET_KEY keeps sessions valid across worker restarts.
+app.secret_key = os.getenv("SECRET_KEY") or secrets.token_hex(32)
+
+# Sessions live in Redis so the cookie only carries a session id. Story
+# segments are stored separately under a short segment id.
+redis_client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+app.config.update(SESSION_TYPE="redis", SESSION_REDIS=redis_client)
+Session(app)
+
+SEGMENT_TTL = 24 * 60 * 60  # seconds
+
+DB_PATH = os.getenv("DB_PATH", "westeros_realty.db")
+
+# One shared connection for the whole process, opened once instead of per
+# request. Every statement on it is serialized through _db_lock.
+_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+_conn.execute("PRAGMA journal_mode=WAL")
+_conn.execute("PRAGMA synchronous=NORMAL")
+_conn.execute("PRAGMA busy_timeout=5000")
+_db_lock = threading.Lock()
+
+_IMPACT_RE = re.compile(
+    r"\(\s*Happiness:\s*([+-]?\d+)\s*,\s*Wealth:\s*([+-]?\d+)\s*\)"
+)
+
+
+def store_segment(segment, replaces=None):
+    """Save a parsed story segment in Redis and return its id.
+
+    The segment it replaces, if any, is deleted in the same round-trip.
+    """
+    segment_id = secrets.token_hex(8)
+    key = f"segment:{segment_id}"
+    pipe = redis_client.pipeline()
+    if replaces:
+        pipe.delete(f"segment:{replaces}")
+    pipe.hset(
+        key,
+        mapping={
+            "story": segment["story"],
+            "choices": orjson.dumps(segment["choices"]),
+        },
+    )
+    pipe.expire(key, SEGMENT_TTL)
+    pipe.execute()
+    return segment_id
+
+
+def load_segment(segment_id):
+    """Fetch a parsed story segment by id, or None if it is missing or expired."""
+    if not segment_id:
+        return None
+    stored = redis_client.hgetall(f"segment:{segment_id}")
+    if not stored:
+        return None
+    return {
+        "story": stored[b"story"].decode(),
+        "choices": orjson.loads(stored[b"choices"]),
+    }
+
+
+# Only the most recent entries are sent to the LLM; the full record stays in
+# the database for replay.
+HISTORY_WINDOW = 5
+PREVIOUS_CHOICES_WINDOW = 20
+
+
+def _parse_segment(text):
+    """Split an LLM story response into its story text and up to three choices."""
+    story, _, choices = text.partition("CHOICES:")
+    lines = [line.strip() for line in choices.splitlines()]
+    return {
+        "story": story.split("STORY:", 1)[-1].strip(),
+        "choices": [line for line in lines if line][:3],
+    }
+
+
+_MAX_WEALTH = 0xFFFFFFFF
+_LOW_40_BITS = (1 << 40) - 1
+
+STARTING_HAPPINESS = 30
+STARTING_WEALTH = 100000
+
+
+@dataclass
+class GameState:
+    """Per-session game state. Cheap enough to rebuild on every request."""
+
+    game_id: str = field(default_factory=lambda: secrets.token_hex(16))
+    player_history: list = field(default_factory=list)
+    # Turn count, happiness and wealth are packed into one int:
+    # bits 40+ hold the turn, bits 32-39 happiness and bits 0-31 wealth.
+    _packed: int = (STARTING_HAPPINESS << 32) | STARTING_WEALTH
+
+    @property
+    def turn_count(self):
+        return self._packed >> 40
+
+    @turn_count.setter
+    def turn_count(self, value):
+        self._packed = (value << 40) | (self._packed & _LOW_40_BITS)
+
+    @property
+    def happiness(self):
+        return (self._packed >> 32) & 0xFF
+
+    @happiness.setter
+    def happiness(self, value):
+        self._packed = (self._packed & ~(0xFF << 32)) | (value << 32)
+
+    @property
+    def wealth(self):
+        return self._packed & _MAX_WEALTH
+
+    @wealth.setter
+    def wealth(self, value):
+        self._packed = (self._packed & ~_MAX_WEALTH) | value
 
-        self.story_chain = self.story_template | self.llm
-        self.consequence_chain = self.consequence_template | self.llm
+    def get_serializable_state(self):
+        """Return a JSON-serializable state of the game."""
+        return {"p": self._packed, "gid": self.game_id, "h": self.player_history}
 
-    def store_choice(self, choice_text):
-        conn = sqlite3.connect("westeros_realty.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO choices (choice_text, game_id) VALUES (?, ?)",
-            (choice_text, self.game_id),
+    @classmethod
+    def from_serializable_state(cls, state):
+        """Rebuild a game from the output of get_serializable_state."""
+        return cls(
+            game_id=state["gid"], player_history=state["h"], _packed=state["p"]
         )
-        conn.commit()
-        conn.close()
-
-    def get_previous_choices(self):
-        conn = sqlite3.connect("westeros_realty.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT choice_text FROM choices WHERE game_id = ?", (self.game_id,)
-        )
-        choices = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return choices
 
     def format_history(self):
         return (
             "No previous choices."
             if not self.player_history
-            else " Then ".join(self.player_history)
+            else " Then ".join(self.player_history[-HISTORY_WINDOW:])
         )
 
-    def parse_stats_impact(self, choice):
-        try:
-            if "(" not in choice or ")" not in choice:
-                return 0, 0
-
-            impacts = choice.split("(")[1].split(")")[0].split(",")
-            if len(impacts) < 2:
-                return 0, 0
-
-            def extract_number(impact_str):
-                return int("".join(c for c in impact_str if c.isdigit() or c in "+-"))
-
-            happiness_impact = extract_number(impacts[0])
-            wealth_impact = extract_number(impacts[1])
+    def format_previous_choices(self):
+        return orjson.dumps(self.player_history[-PREVIOUS_CHOICES_WINDOW:]).decode()
 
-            return happiness_impact, wealth_impact
-
-        except Exception as e:
-            print(f"Error parsing choice impacts: {e}")
+    def parse_stats_impact(self, choice):
+        match = _IMPACT_RE.search(choice)
+        if not match:
             return 0, 0
+        return int(match.group(1)), int(match.group(2))
 
     def update_stats(self, choice_text):
         happiness_impact, wealth_impact = self.parse_stats_impact(choice_text)
         self.happiness = max(0, min(100, self.happiness + happiness_impact))
-        self.wealth = max(0, self.wealth + wealth_impact)
+        self.wealth = max(0, min(_MAX_WEALTH, self.wealth + wealth_impact))
         return happiness_impact, wealth_impact
 
     def check_game_over(self):
@@ -191,75 +212,224 @@ class ModernWesterosGame:
             )
         return False, ""
 
-    def start_game(self):
+
+class GameEngine:
+    """LLM chains, prompts and database access shared by every game."""
+
+    def __init__(self):
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OpenAI API key not found in environment variables")
+
+        # Responses are 2-3 sentences plus three short choices, so a tight
+        # token cap bounds decode time without truncating normal output.
+        self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.8, max_tokens=220)
+
+        self.setup_templates()
+        self.setup_database()
+
+    def setup_database(self):
+        with _db_lock, _conn:
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS choices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    choice_text TEXT NOT NULL,
+                    game_id TEXT NOT NULL
+                )
+            """
+            )
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS turn_state (
+                    game_id TEXT NOT NULL,
+                    turn INTEGER NOT NULL,
+                    happiness INTEGER NOT NULL,
+                    wealth INTEGER NOT NULL,
+                    PRIMARY KEY (game_id, turn)
+                )
+            """
+            )
+
+    def setup_templates(self):
+        # Static instructions live in a system message built once and shared
+        # verbatim by every call; only the short user message is rendered per
+        # turn. At ~300 tokens the prefix is below OpenAI's 1024-token prompt
+        # caching threshold, so no provider-side cache discount applies.
+        self.story_system = SystemMessage(
+            content=(
+                "You are a witty narrator in a world where Jon Snow has traded his Night's Watch cloak for a realtor's suit. "
+                "Mix modern real estate scenarios with Game of Thrones references and humor.\n\n"
+                "Generate a short story segment (2-3 sentences) with Game of Thrones references.\n"
+                "Then provide 3 UNIQUE choices that are witty and concise (max 15 words each).\n"
+                "Use GOT-style humor and puns in the choices. Each choice must have exact numerical impacts in parentheses.\n\n"
+                "Format your response as follows:\n"
+                "STORY: [Your story text here]\n"
+                "CHOICES:\n"
+                "1. Act like a Dothraki: Take what is yours with fire and blood (Happiness: +20, Wealth: -50000)\n"
+                "2. Consult with Bran: See the future and make wise investments (Happiness: +10, Wealth: +25000)\n"
+                "3. Meet with the Iron Bank: Get a loan and rule the market (Happiness: -15, Wealth: +40000)\n\n"
+                "IMPORTANT FORMAT RULES:\n"
+                "- Do not use square brackets []\n"
+                "- Never use +/- together\n"
+                "- Always specify a sign (+ or -) for every number\n"
+                "- No spaces in numbers\n"
+                "- Keep exact order: Happiness, Wealth\n"
+            )
+        )
+
+        self.consequence_system = SystemMessage(
+            content=(
+                "Generate a consequence (2-3 sentences) that blends modern real estate outcomes with Game of Thrones references.\n"
+                "Be creative and humorous while keeping the real estate aspects realistic."
+            )
+        )
+
+        self.story_chain = (
+            RunnableLambda(self.render_story) | self.llm | StrOutputParser()
+        )
+        self.consequence_chain = (
+            RunnableLambda(self.render_consequence) | self.llm | StrOutputParser()
+        )
+
+    def render_story(self, inputs):
+        return [
+            self.story_system,
+            HumanMessage(
+                content=(
+                    "Jon's Current Status:\n"
+                    f"Happiness: {inputs['happiness']}/100\n"
+                    f"Wealth: ${inputs['wealth']}\n\n"
+                    f"Previous choices in this game: {inputs['history']}\n"
+                    f"Previously used choices in database: {inputs['previous_choices']}\n"
+                    f"Current situation: {inputs['current_situation']}"
+                )
+            ),
+        ]
+
+    def render_consequence(self, inputs):
+        return [
+            self.consequence_system,
+            HumanMessage(
+                content=(
+                    f"Based on Jon's history: {inputs['history']}\n"
+                    "Current status:\n"
+                    f"Happiness: {inputs['happiness']}/100\n"
+                    f"Wealth: ${inputs['wealth']}\n"
+                    f"They chose: {inputs['choice']}"
+                )
+            ),
+        ]
+
+    def record_turn(self, game, choice_text):
+        """Store the choice and the resulting stats in a single transaction."""
+        with _db_lock, _conn:
+            _conn.execute("BEGIN")
+            _conn.execute(
+                "INSERT INTO choices (choice_text, game_id) VALUES (?, ?)",
+                (choice_text, game.game_id),
+            )
+            _conn.execute(
+                "INSERT OR REPLACE INTO turn_state (game_id, turn, happiness, wealth) "
+                "VALUES (?, ?, ?, ?)",
+                (game.game_id, game.turn_count, game.happiness, game.wealth),
+            )
+        # Keep the session history in step with the choices table, so it can
+        # stand in for a database read when the game is reloaded.
+        game.player_history.append(choice_text)
+
+    def store_choices(self, game, choice_texts):
+        """Bulk-insert several choices at once, e.g. when restoring a game."""
+        with _db_lock, _conn:
+            _conn.execute("BEGIN")
+            _conn.executemany(
+                "INSERT INTO choices (choice_text, game_id) VALUES (?, ?)",
+                [(choice_text, game.game_id) for choice_text in choice_texts],
+            )
+        game.player_history.extend(choice_texts)
+
+    def start_game(self, game):
         initial_situation = (
             "Jon Snow, having left the Night's Watch for a new life in modern-day real estate, "
             "stands before the gleaming Glass Tower in downtown King's Landing (formerly Manhattan). "
             "His father's words echo in his head: 'Winter is Coming... and so is the housing market crash.'"
         )
-        return self.get_story_segment(initial_situation)
+        return self.get_story_segment(game, initial_situation)
 
-    def get_story_segment(self, current_situation):
+    def get_story_segment(self, game, current_situation):
         try:
-            previous_choices = self.get_previous_choices()
             response = self.story_chain.invoke(
                 {
-                    "history": self.format_history(),
+                    "history": game.format_history(),
                     "current_situation": current_situation,
-                    "happiness": self.happiness,
-                    "wealth": self.wealth,
-                    "previous_choices": json.dumps(previous_choices),
+                    "happiness": game.happiness,
+                    "wealth": game.wealth,
+                    "previous_choices": game.format_previous_choices(),
                 }
             )
-            return response
+            return _parse_segment(response)
 
         except Exception as e:
             print(f"Error generating story segment: {e}")
-            return "Error generating story segment."
+            return _parse_segment("Error generating story segment.")
 
-    def make_choice(self, choice_text):
+    def make_choice(self, game, choice_text):
         try:
-            self.turn_count += 1
+            game.turn_count += 1
             if not choice_text or len(choice_text.strip()) == 0:
                 raise ValueError("Empty choice text")
 
-            self.store_choice(choice_text)
-            self.update_stats(choice_text)
-
-            consequence_response = self.consequence_chain.invoke(
-                {
-                    "history": self.format_history(),
-                    "choice": choice_text,
-                    "happiness": self.happiness,
-                    "wealth": self.wealth,
-                }
-            )
+            game.update_stats(choice_text)
+            consequence_inputs = {
+                "history": game.format_history(),
+                "choice": choice_text,
+                "happiness": game.happiness,
+                "wealth": game.wealth,
+            }
+            self.record_turn(game, choice_text)
 
-            consequence = consequence_response
-            self.player_history.append(choice_text)
+            consequence = self.consequence_chain.invoke(consequence_inputs)
 
-            return consequence, self.get_story_segment(consequence)
+            return consequence, self.get_story_segment(game, consequence)
 
         except Exception as e:
             print(f"Error processing choice: {e}")
             return "The outcome of your choice was unclear...", self.get_story_segment(
-                "Jon needs to reassess his options..."
+                game, "Jon needs to reassess his options..."
             )
 
 
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the shared GameEngine, building it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = GameEngine()
+    return _engine
+
+
 @app.route("/api/game", methods=["POST"])
 def game_action():
     try:
         data = request.get_json() or {}
         choice = data.get("choice")
 
+        current_segment = load_segment(session.get("segment_id"))
+
         # If no choice provided or no existing game, start new game
-        if not choice or "game_state" not in session:
-            game = ModernWesterosGame()
-            current_segment = game.start_game()
+        if not choice or "game_state" not in session or current_segment is None:
+            game = GameState()
+            current_segment = get_engine().start_game(game)
 
             session["game_state"] = game.get_serializable_state()
-            session["current_segment"] = current_segment
+            session["segment_id"] = store_segment(
+                current_segment, replaces=session.get("segment_id")
+            )
 
             return jsonify(
                 {
@@ -268,16 +438,8 @@ def game_action():
                         "turn": game.turn_count + 1,
                         "happiness": game.happiness,
                         "wealth": game.wealth,
-                        "story": current_segment.split("STORY:")[1]
-                        .split("CHOICES:")[0]
-                        .strip(),
-                        "choices": [
-                            choice.strip()
-                            for choice in current_segment.split("CHOICES:\n")[1].split(
-                                "\n"
-                            )
-                            if choice.strip()
-                        ][:3],
+                        "story": current_segment["story"],
+                        "choices": current_segment["choices"],
                     },
                 }
             )
@@ -286,17 +448,16 @@ def game_action():
         if choice not in ["1", "2", "3"]:
             return jsonify({"status": "error", "message": "Invalid choice"}), 400
 
-        game = ModernWesterosGame()
-        game.load_state(session["game_state"])
-        current_segment = session["current_segment"]
+        game = GameState.from_serializable_state(session["game_state"])
 
-        choices = current_segment.split("CHOICES:\n")[1].split("\n")
-        chosen_action = choices[int(choice) - 1].lstrip("123. ")
+        chosen_action = current_segment["choices"][int(choice) - 1].lstrip("123. ")
 
-        consequence, next_segment = game.make_choice(chosen_action)
+        consequence, next_segment = get_engine().make_choice(game, chosen_action)
 
         session["game_state"] = game.get_serializable_state()
-        session["current_segment"] = next_segment
+        session["segment_id"] = store_segment(
+            next_segment, replaces=session["segment_id"]
+        )
 
         is_game_over, message = game.check_game_over()
 
@@ -307,12 +468,8 @@ def game_action():
                 "happiness": game.happiness,
                 "wealth": game.wealth,
                 "consequence": consequence,
-                "story": next_segment.split("STORY:")[1].split("CHOICES:")[0].strip(),
-                "choices": [
-                    choice.strip()
-                    for choice in next_segment.split("CHOICES:\n")[1].split("\n")
-                    if choice.strip()
-                ][:3],
+                "story": next_segment["story"],
+                "choices": next_segment["choices"],
                 "is_game_over": is_game_over,
                 "game_over_message": message if is_game_over else None,
             },
@@ -326,6 +483,9 @@ def game_action():
 
 @app.route("/api/reset", methods=["POST"])
 def reset_game():
+    segment_id = session.get("segment_id")
+    if segment_id:
+        redis_client.delete(f"segment:{segment_id}")
     session.clear()
     return jsonify({"status": "success", "message": "Game reset successfully"})
 
@@ -335,5 +495,17 @@ def index():
     return render_template("index.html")
 
 
+def warm_up():
+    """Open the database and the OpenAI connection before the first request."""
+    try:
+        engine = get_engine()
+        with _db_lock:
+            _conn.execute("SELECT COUNT(*) FROM choices").fetchone()
+        engine.llm.bind(max_tokens=1).invoke("ping")
+    except Exception as e:
+        print(f"Error warming up: {e}")
+
+
 if __name__ == "__main__":
+    warm_up()
     app.run()
@@ -0,0 +1,6 @@
+def post_fork(server, worker):
+    # Warm up in each worker after the fork so no worker inherits the
+    # master's OpenAI connection pool.
+    from game import warm_up
+
+    warm_up()
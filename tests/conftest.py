@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+# game opens its SQLite database and reads its settings at import time; keep
+# the database out of the repo and let the engine build without a real key.
+os.environ.setdefault(
+    "DB_PATH", os.path.join(tempfile.mkdtemp(), "westeros_realty.db")
+)
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import game  # noqa: E402
+
+STORY = (
+    "STORY: Jon tours a drafty castle.\n"
+    "CHOICES:\n"
+    "1. Buy it (Happiness: +10, Wealth: -20000)\n"
+    "2. Flip it (Happiness: -5, Wealth: +30000)\n"
+    "3. Walk away (Happiness: +0, Wealth: +0)\n"
+)
+
+
+@pytest.fixture
+def engine():
+    """A GameEngine whose chains answer locally instead of calling OpenAI."""
+    engine = game.GameEngine()
+    engine.story_chain = RunnableLambda(lambda inputs: STORY)
+    engine.consequence_chain = RunnableLambda(
+        lambda inputs: f"Consequence of {inputs['choice']}"
+    )
+    return engine
+
+
+class FakeRedis:
+    """In-memory stand-in for the Redis calls made by game and Flask-Session."""
+
+    def __init__(self):
+        self.data = {}
+
+    @staticmethod
+    def _bytes(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None):
+        self.data[name] = self._bytes(value)
+
+    def delete(self, *names):
+        for name in names:
+            self.data.pop(name, None)
+
+    def hset(self, name, mapping):
+        stored = self.data.setdefault(name, {})
+        for key, value in mapping.items():
+            stored[self._bytes(key)] = self._bytes(value)
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def expire(self, name, seconds):
+        pass
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs))
+
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(game, "redis_client", fake)
+    monkeypatch.setattr(game.app.session_interface, "client", fake)
+    return fake
+
+
+@pytest.fixture
+def client(engine, fake_redis, monkeypatch):
+    """A Flask test client backed by the fake engine and fake Redis."""
+    monkeypatch.setattr(game, "_engine", engine)
+    return game.app.test_client()
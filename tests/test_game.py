@@ -0,0 +1,265 @@
+import orjson
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+import game as game_module
+from game import (
+    PREVIOUS_CHOICES_WINDOW,
+    STARTING_HAPPINESS,
+    STARTING_WEALTH,
+    GameState,
+    _MAX_WEALTH,
+    _parse_segment,
+)
+
+
+def test_previous_choices_keep_the_latest_window():
+    game = GameState()
+    choices = [f'choice "{i}" ünïcode' for i in range(PREVIOUS_CHOICES_WINDOW + 5)]
+    for count, choice in enumerate(choices, start=1):
+        game.player_history.append(choice)
+        expected = choices[max(0, count - PREVIOUS_CHOICES_WINDOW) : count]
+        assert orjson.loads(game.format_previous_choices()) == expected
+
+
+def test_failed_consequence_still_records_choice_in_history(engine):
+    def fail(inputs):
+        raise RuntimeError("OpenAI is down")
+
+    engine.consequence_chain = RunnableLambda(fail)
+    game = GameState()
+    choice = "Buy it (Happiness: +10, Wealth: -20000)"
+
+    consequence, _ = engine.make_choice(game, choice)
+
+    assert consequence == "The outcome of your choice was unclear..."
+    assert game.player_history == [choice]
+
+
+def test_parse_segment_splits_story_and_choices():
+    segment = _parse_segment(
+        "STORY: Jon lists Winterfell.\n"
+        "CHOICES:\n"
+        "1. A (Happiness: +1, Wealth: +1)\n\n"
+        "2. B (Happiness: +2, Wealth: +2)\n"
+        "3. C (Happiness: +3, Wealth: +3)\n"
+        "4. D (Happiness: +4, Wealth: +4)\n"
+    )
+    assert segment["story"] == "Jon lists Winterfell."
+    assert segment["choices"] == [
+        "1. A (Happiness: +1, Wealth: +1)",
+        "2. B (Happiness: +2, Wealth: +2)",
+        "3. C (Happiness: +3, Wealth: +3)",
+    ]
+
+
+def test_parse_segment_without_choices_marker():
+    segment = _parse_segment("Error generating story segment.")
+    assert segment == {"story": "Error generating story segment.", "choices": []}
+
+
+@pytest.fixture
+def statements():
+    """Record every SQL statement run on the shared connection."""
+    executed = []
+    game_module._conn.set_trace_callback(executed.append)
+    yield executed
+    game_module._conn.set_trace_callback(None)
+
+
+def _rows(sql, game_id):
+    return game_module._conn.execute(sql, (game_id,)).fetchall()
+
+
+def test_record_turn_writes_choice_and_stats_in_one_commit(engine, statements):
+    game = GameState()
+    game.turn_count = 1
+    game.update_stats("Buy it (Happiness: +10, Wealth: -20000)")
+
+    engine.record_turn(game, "Buy it")
+
+    transaction = [s for s in statements if s in ("BEGIN", "COMMIT")]
+    assert transaction == ["BEGIN", "COMMIT"]
+    assert _rows(
+        "SELECT choice_text FROM choices WHERE game_id = ?", game.game_id
+    ) == [("Buy it",)]
+    assert _rows(
+        "SELECT turn, happiness, wealth FROM turn_state WHERE game_id = ?",
+        game.game_id,
+    ) == [(1, 40, 80000)]
+    assert game.player_history == ["Buy it"]
+
+
+def test_store_choices_bulk_inserts_and_extends_history(engine, statements):
+    game = GameState()
+
+    engine.store_choices(game, ["Buy it", "Flip it"])
+
+    assert statements.count("COMMIT") == 1
+    assert _rows(
+        "SELECT choice_text FROM choices WHERE game_id = ? ORDER BY id", game.game_id
+    ) == [("Buy it",), ("Flip it",)]
+    assert game.player_history == ["Buy it", "Flip it"]
+    restored = GameState.from_serializable_state(game.get_serializable_state())
+    assert orjson.loads(restored.format_previous_choices()) == ["Buy it", "Flip it"]
+
+
+def test_new_game_starts_with_default_stats():
+    game = GameState()
+    assert (game.turn_count, game.happiness, game.wealth) == (
+        0,
+        STARTING_HAPPINESS,
+        STARTING_WEALTH,
+    )
+
+
+@pytest.mark.parametrize("wealth", [0, 1, STARTING_WEALTH, _MAX_WEALTH])
+@pytest.mark.parametrize("happiness", [0, 55, 100])
+@pytest.mark.parametrize("turn", [0, 1, 10])
+def test_packed_fields_round_trip(turn, happiness, wealth):
+    game = GameState()
+    game.turn_count = turn
+    game.happiness = happiness
+    game.wealth = wealth
+    assert (game.turn_count, game.happiness, game.wealth) == (turn, happiness, wealth)
+
+    restored = GameState.from_serializable_state(game.get_serializable_state())
+    assert (restored.turn_count, restored.happiness, restored.wealth) == (
+        turn,
+        happiness,
+        wealth,
+    )
+
+
+def test_setting_one_field_leaves_the_others_alone():
+    game = GameState()
+    game.wealth = _MAX_WEALTH
+    game.happiness = 100
+    game.turn_count = 3
+    game.wealth = 0
+    assert (game.turn_count, game.happiness, game.wealth) == (3, 100, 0)
+
+
+@pytest.mark.parametrize(
+    "choice, happiness, wealth",
+    [
+        ("Party (Happiness: +200, Wealth: +0)", 100, STARTING_WEALTH),
+        ("Sulk (Happiness: -200, Wealth: +0)", 0, STARTING_WEALTH),
+        ("Splurge (Happiness: +0, Wealth: -999999)", STARTING_HAPPINESS, 0),
+        (
+            "Hoard (Happiness: +0, Wealth: +9999999999)",
+            STARTING_HAPPINESS,
+            _MAX_WEALTH,
+        ),
+    ],
+)
+def test_update_stats_clamps(choice, happiness, wealth):
+    game = GameState()
+    game.update_stats(choice)
+    assert (game.happiness, game.wealth) == (happiness, wealth)
+
+
+def test_start_game_returns_parsed_opening(engine):
+    game = GameState()
+
+    segment = engine.start_game(game)
+
+    assert segment["story"] == "Jon tours a drafty castle."
+    assert len(segment["choices"]) == 3
+    assert game.turn_count == 0 and game.player_history == []
+
+
+def test_make_choice_advances_the_game(engine):
+    game = GameState()
+    choice = "Buy it (Happiness: +10, Wealth: -20000)"
+
+    consequence, segment = engine.make_choice(game, choice)
+
+    assert consequence == f"Consequence of {choice}"
+    assert segment["story"] == "Jon tours a drafty castle."
+    assert (game.turn_count, game.happiness, game.wealth) == (
+        1,
+        STARTING_HAPPINESS + 10,
+        STARTING_WEALTH - 20000,
+    )
+    assert game.player_history == [choice]
+
+
+def test_game_action_plays_a_turn(client):
+    started = client.post("/api/game", json={}).get_json()
+    assert started["status"] == "success"
+    assert started["game_state"]["turn"] == 1
+    assert started["game_state"]["choices"][0].startswith("1. Buy it")
+
+    played = client.post("/api/game", json={"choice": "1"}).get_json()
+    state = played["game_state"]
+    assert state["turn"] == 2
+    assert state["consequence"] == (
+        "Consequence of Buy it (Happiness: +10, Wealth: -20000)"
+    )
+    assert (state["happiness"], state["wealth"]) == (
+        STARTING_HAPPINESS + 10,
+        STARTING_WEALTH - 20000,
+    )
+    assert state["is_game_over"] is False
+
+
+def test_game_action_rejects_unknown_choice(client):
+    client.post("/api/game", json={})
+
+    response = client.post("/api/game", json={"choice": "7"})
+
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Invalid choice"
+
+
+def test_reset_starts_a_fresh_game(client):
+    client.post("/api/game", json={})
+    client.post("/api/game", json={"choice": "2"})
+
+    assert client.post("/api/reset").get_json()["status"] == "success"
+
+    restarted = client.post("/api/game", json={"choice": "1"}).get_json()
+    assert restarted["game_state"]["turn"] == 1
+    assert "consequence" not in restarted["game_state"]
+
+
+def test_segment_round_trips_through_redis(fake_redis):
+    segment = {"story": "Jon lists Winterfell.", "choices": ["1. A", "2. B"]}
+
+    segment_id = game_module.store_segment(segment)
+
+    assert game_module.load_segment(segment_id) == segment
+    assert game_module.load_segment(None) is None
+    assert game_module.load_segment("missing") is None
+
+
+def test_storing_a_segment_deletes_the_one_it_replaces(fake_redis):
+    first = game_module.store_segment({"story": "one", "choices": []})
+    second = game_module.store_segment(
+        {"story": "two", "choices": []}, replaces=first
+    )
+
+    assert game_module.load_segment(first) is None
+    assert game_module.load_segment(second)["story"] == "two"
+
+
+def test_turns_and_reset_leave_no_stale_segments(client, fake_redis):
+    client.post("/api/game", json={})
+    client.post("/api/game", json={"choice": "1"})
+    segments = [key for key in fake_redis.data if key.startswith("segment:")]
+    assert len(segments) == 1
+
+    client.post("/api/reset")
+    assert not [key for key in fake_redis.data if key.startswith("segment:")]
+
+
+def test_jsonify_serializes_with_orjson():
+    payload = {"status": "success", "choices": ["1. Ünïcode"], "wealth": 100000}
+
+    with game_module.app.app_context():
+        response = game_module.jsonify(payload)
+
+    assert response.mimetype == "application/json"
+    assert response.get_data() == orjson.dumps(payload)
+    assert game_module.app.json.loads(response.get_data()) == payload